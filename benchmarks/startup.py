@@ -0,0 +1,107 @@
+#
+#    Copyright 2022 Alessio Pinna <alessio.pinna@aiselis.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+Startup benchmark: import time of ribes and time to first consume.
+
+    python benchmarks/startup.py [--runs N]
+
+Time to first consume runs each sample in a fresh process, from importing ribes until the handler of a
+published request runs. It needs a running broker and is measured only when BROKER_URL is set.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENV = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')]))}
+
+IMPORTS = [
+    'import ribes',
+    'from ribes import Ribes',
+    'import aio_pika',
+]
+
+
+def import_time(statement: str, runs: int) -> list:
+    timings = []
+    for _ in range(runs):
+        output = subprocess.check_output([
+            sys.executable, '-c',
+            f'import time; t = time.perf_counter(); {statement}; print(time.perf_counter() - t)'
+        ], env=ENV)
+        timings.append(float(output))
+    return timings
+
+
+async def first_consume() -> float:
+    started = time.perf_counter()
+    from ribes import Ribes
+    app = Ribes('benchmark')
+    consumed = None
+
+    @app.register('benchmark.ping')
+    def ping():
+        nonlocal consumed
+        consumed = time.perf_counter()
+        return 'pong'
+
+    try:
+        await app.start_listener()
+        await app.start_caller()
+        await app.caller('benchmark.ping', timeout=10)()
+    finally:
+        await app.drain()
+        import aio_pika
+        connection = await aio_pika.connect(app.settings.broker_url)
+        async with connection:
+            channel = await connection.channel()
+            await channel.queue_delete('benchmark.benchmark')
+    return consumed - started
+
+
+def first_consume_time(runs: int) -> list:
+    return [
+        float(subprocess.check_output([sys.executable, __file__, '--first-consume'], env=ENV))
+        for _ in range(runs)
+    ]
+
+
+def report(name: str, timings: list):
+    print(f'{name:<30} median {statistics.median(timings) * 1000:8.2f} ms  '
+          f'min {min(timings) * 1000:8.2f} ms  max {max(timings) * 1000:8.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--first-consume', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.first_consume:
+        print(asyncio.run(first_consume()))
+        return
+    for statement in IMPORTS:
+        report(statement, import_time(statement, args.runs))
+    if os.environ.get('BROKER_URL'):
+        report('time to first consume', first_consume_time(args.runs))
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,13 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
-from ribes.app import Ribes
-
 __version__ = '0.1.2'
+
+__all__ = ['Ribes']
+
+
+def __getattr__(name):
+    if name == 'Ribes':
+        from ribes.app import Ribes
+        return Ribes
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
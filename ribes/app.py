@@ -13,25 +13,46 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+from __future__ import annotations
+
 import asyncio
 import logging
+import signal
+import time
 
 from functools import cached_property
-from typing import MutableMapping, Any, Callable
-
-from aio_pika import Message, connect
-from aio_pika.abc import (
-    AbstractIncomingMessage,
-    AbstractConnection,
-    AbstractChannel,
-    AbstractExchange,
-    AbstractQueue,
-    ExchangeType
+from typing import (
+    MutableMapping, Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Iterable, Union, TYPE_CHECKING
 )
 
+from ribes.capture import Capture
 from ribes.caller import RemoteCaller
 from ribes.dispatcher import Dispatcher
-from ribes.settings import RibesSettings
+from ribes.errors import ShutdownError
+from ribes.profiler import Profiler
+from ribes.publisher import PublishBuffer
+from ribes.settings import RibesSettings, get_settings
+from ribes.transport import connect, message_class
+
+if TYPE_CHECKING:
+    from aio_pika.abc import (
+        AbstractIncomingMessage,
+        AbstractConnection,
+        AbstractChannel,
+        AbstractExchange,
+        AbstractQueue,
+    )
+
+
+def topic_matches(pattern: str, routing_key: str) -> bool:
+    def match(words, keys):
+        if not words:
+            return not keys
+        if words[0] == '#':
+            return any(match(words[1:], keys[index:]) for index in range(len(keys) + 1))
+        return bool(keys) and words[0] in ('*', keys[0]) and match(words[1:], keys[1:])
+
+    return match(pattern.split('.'), routing_key.split('.'))
 
 
 class Ribes:
@@ -42,23 +63,57 @@ class Ribes:
     _connection: AbstractConnection = None
     _channel: AbstractChannel = None
     _exchange: AbstractExchange = None
+    _publisher: Optional[PublishBuffer] = None
 
     _callback_queue: AbstractQueue = None
-    _futures: MutableMapping[str, asyncio.Future] = {}
+    _futures: MutableMapping[str, asyncio.Future]
+
+    _consumers: List[Tuple[AbstractQueue, str]]
+    _inflight: Set[asyncio.Task]
+    _draining: bool = False
+    _drain_task: Optional[asyncio.Task] = None
 
     @cached_property
     def _loop(self) -> asyncio.AbstractEventLoop:
         return asyncio.get_running_loop()
 
+    @cached_property
+    def _drained(self) -> asyncio.Event:
+        return asyncio.Event()
+
+    @cached_property
+    def profiler(self) -> Profiler:
+        return Profiler(
+            sample_rate=self.settings.profile_sample_rate,
+            methods=self.settings.profile_methods,
+            slow_threshold=self.settings.profile_slow_threshold,
+            buffer_size=self.settings.profile_buffer_size,
+            use_cprofile=self.settings.profile_cprofile,
+            stack_interval=self.settings.profile_stack_interval,
+        )
+
+    @cached_property
+    def capture(self) -> Optional[Capture]:
+        if not self.settings.capture_path:
+            return None
+        return Capture(self.settings.capture_path, self.settings.capture_sample_rate)
+
     @cached_property
     def _dispatcher(self) -> Dispatcher:
-        return Dispatcher()
+        return Dispatcher(self.profiler)
+
+    @property
+    def dispatcher(self) -> Dispatcher:
+        return self._dispatcher
 
     def __init__(self, name: str):
-        self.settings = RibesSettings()
-        self.settings.exchange = name
+        self.settings = get_settings().copy(update={'exchange': name}, deep=True)
+        self._futures = {}
+        self._consumers = []
+        self._inflight = set()
 
     async def connect(self) -> None:
+        from aio_pika import ExchangeType
         if self._connection:
             return
         self.logger.info(f'Connection to {self.settings.broker_url}')
@@ -66,31 +121,78 @@ class Ribes:
         self._channel = await self._connection.channel()
         self._exchange = await self._channel.declare_exchange(self.settings.exchange, durable=True,
                                                               type=ExchangeType.TOPIC)
+        if self.settings.publish_buffer:
+            self._publisher = PublishBuffer(
+                self._exchange,
+                batch_size=self.settings.publish_batch_size,
+                flush_interval=self.settings.publish_flush_interval,
+                max_bytes=self.settings.publish_max_bytes,
+                overflow=self.settings.publish_overflow,
+            )
+
+    @property
+    def publisher(self) -> Union[AbstractExchange, PublishBuffer]:
+        return self._publisher or self._exchange
 
     async def on_request_message(self, message: AbstractIncomingMessage):
-        async with message.process(requeue=False):
-            assert message.reply_to is not None
-            request = message.body.decode()
-            if response := await self._dispatcher.dispatch(request):
-                await self._exchange.publish(
-                    Message(body=response.encode(), correlation_id=message.correlation_id),
-                    routing_key=message.reply_to,
-                )
+        if self._draining:
+            await message.reject(requeue=True)
+            return
+        task = asyncio.current_task()
+        self._inflight.add(task)
+        try:
+            async with message.process(requeue=False, ignore_processed=True):
+                try:
+                    assert message.reply_to is not None
+                    request = message.body.decode()
+                    if self.capture and self.capture.should_sample():
+                        started = time.perf_counter()
+                        response = await self._dispatcher.dispatch(request)
+                        self.capture.record(request, time.perf_counter() - started)
+                    else:
+                        response = await self._dispatcher.dispatch(request)
+                    if response:
+                        await self.publisher.publish(
+                            message_class()(body=response.encode(), correlation_id=message.correlation_id),
+                            routing_key=message.reply_to,
+                        )
+                except asyncio.CancelledError:
+                    await message.reject(requeue=True)
+                    raise
+        finally:
+            self._inflight.discard(task)
 
     async def on_response_message(self, message: AbstractIncomingMessage):
         if message.correlation_id is None:
             self.logger.error(f"Bad message {message!r}")
             return
-        future: asyncio.Future = self._futures.pop(message.correlation_id)
+        future: asyncio.Future = self._futures.pop(message.correlation_id, None)
+        if future is None or future.done():
+            self.logger.debug(f'Dropped late response {message.correlation_id}')
+            return
         future.set_result(message.body.decode())
 
+    def routes(self) -> Dict[str, str]:
+        routes = dict(self.settings.routes)
+        for namespace, methods in self._dispatcher.namespaces.items():
+            if namespace:
+                overlapping = [key for key in self.settings.routes for method in methods if topic_matches(key, method)]
+                if overlapping:
+                    raise ValueError(f'Static routes {overlapping} overlap namespace {namespace!r}')
+                queue_name = self.settings.queue_groups.get(namespace, f'{self.settings.exchange}.{namespace}')
+                routes[f'{namespace}.*'] = queue_name
+        return routes
+
     async def start_listener(self):
         await self.connect()
         self.logger.info(f'Ribes Listener started')
-        for routing_key, queue_name in self.settings.routes.items():
-            queue = await self._channel.declare_queue(queue_name, durable=True)
-            await queue.bind(self._exchange, routing_key=routing_key)
-            await queue.consume(self.on_request_message)
+        queues: Dict[str, AbstractQueue] = {}
+        for routing_key, queue_name in self.routes().items():
+            if queue_name not in queues:
+                queues[queue_name] = await self._channel.declare_queue(queue_name, durable=True)
+            await queues[queue_name].bind(self._exchange, routing_key=routing_key)
+        for queue in queues.values():
+            self._consumers.append((queue, await queue.consume(self.on_request_message)))
 
     async def start_caller(self):
         await self.connect()
@@ -99,13 +201,66 @@ class Ribes:
         await self._callback_queue.bind(self._exchange, self._callback_queue.name)
         await self._callback_queue.consume(self.on_response_message)
 
-    def caller(self, name: str, ignore_result=False) -> RemoteCaller:
-        return RemoteCaller(name, ignore_result, self._loop, self._futures, self._exchange, self._callback_queue.name)
+    async def drain(self, timeout: Optional[float] = None):
+        if self._draining:
+            return await self._drained.wait()
+        self._draining = True
+        self._drained.clear()
+        try:
+            self.logger.info(f'Ribes draining {len(self._inflight)} requests')
+            for queue, consumer_tag in self._consumers:
+                await self._teardown(f'cancel consumer {consumer_tag}', queue.cancel(consumer_tag))
+            self._consumers.clear()
+            if self._inflight:
+                _, pending = await asyncio.wait(set(self._inflight), timeout=timeout)
+                if pending:
+                    self.logger.warning(f'Drain timeout, requeue {len(pending)} requests in flight')
+                    for task in pending:
+                        task.cancel()
+                    await asyncio.wait(pending)
+            for future in self._futures.values():
+                if not future.done():
+                    future.set_exception(ShutdownError())
+            self._futures.clear()
+            if self._publisher:
+                await self._teardown('close publisher', self._publisher.close())
+            if self._connection:
+                await self._teardown('close connection', self._connection.close())
+            if self.capture:
+                await self._teardown('close capture', self.capture.close())
+        finally:
+            self._connection = self._channel = self._exchange = self._callback_queue = self._publisher = None
+            self._draining = False
+            self._drained.set()
+        self.logger.info(f'Ribes drained')
+
+    async def _teardown(self, step: str, awaitable: Awaitable):
+        try:
+            await awaitable
+        except Exception as error:
+            self.logger.error(f'Drain failed to {step}: {error!r}')
+
+    async def wait_drained(self):
+        await self._drained.wait()
+
+    def install_signal_handlers(self, timeout: Optional[float] = None,
+                                signals: Iterable[int] = (signal.SIGTERM, signal.SIGINT)):
+        for sig in signals:
+            self._loop.add_signal_handler(sig, self._on_signal, timeout)
+
+    def _on_signal(self, timeout: Optional[float]):
+        self._drain_task = self._loop.create_task(self.drain(timeout))
+
+    def caller(self, name: str, ignore_result=False, **policy) -> RemoteCaller:
+        return RemoteCaller(name, ignore_result, self._loop, self._futures, self.publisher, self._callback_queue.name,
+                            **policy)
 
-    def register(self, name: str) -> Callable[..., Any]:
+    def register(self, name: str, profile=False) -> Callable[..., Any]:
         def decorator(func) -> Callable[..., Any]:
             nonlocal name, self
             self._dispatcher.register(name, func)
+            if profile:
+                self.profiler.methods.add(name)
             return func
 
         return decorator
@@ -16,26 +16,39 @@
 import asyncio
 import json
 import logging
+import random
+import time
 import uuid
-from typing import MutableMapping
+from collections import deque
+from typing import MutableMapping, Optional, Iterable, Union, TYPE_CHECKING
 
-from aio_pika import Message
-from aio_pika.abc import AbstractExchange
-
-from ribes.errors import ErrorMap
+from ribes.errors import ErrorMap, BaseJsonRpcError, InternalError
 from ribes.models import JsonRpcRequest, JsonRpcResponse
+from ribes.publisher import PublishBuffer
+from ribes.transport import message_class
+
+if TYPE_CHECKING:
+    from aio_pika.abc import AbstractExchange
 
 
 class RemoteCaller:
     logger = logging.getLogger(__name__)
 
+    hedge_min_samples = 20
+
     def __init__(self,
                  name: str,
                  ignore_result: bool,
                  loop: asyncio.AbstractEventLoop,
                  futures: MutableMapping[str, asyncio.Future],
-                 exchange: AbstractExchange,
+                 exchange: Union['AbstractExchange', PublishBuffer],
                  callback: str,
+                 timeout: Optional[float] = None,
+                 retries: int = 0,
+                 backoff: float = 0.1,
+                 retry_codes: Iterable[int] = (InternalError.code,),
+                 hedge: bool = False,
+                 hedge_delay: float = 0.1,
                  ):
         self._name = name
         self._ignore_result = ignore_result
@@ -43,30 +56,90 @@ class RemoteCaller:
         self._futures = futures
         self._exchange = exchange
         self._callback = callback
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._retry_codes = frozenset(retry_codes)
+        self._hedge = hedge
+        self._hedge_delay = hedge_delay
+        self._latencies = deque(maxlen=100)
         self._id = None if ignore_result else 1
 
-    async def __call__(self, *args, **kwargs):
-        params = args if args else kwargs
+    def hedge_delay(self) -> float:
+        if len(self._latencies) < self.hedge_min_samples:
+            return self._hedge_delay
+        latencies = sorted(self._latencies)
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def backoff_delay(self, attempt: int) -> float:
+        return random.uniform(0, self._backoff * 2 ** attempt)
+
+    def is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, asyncio.TimeoutError):
+            return True
+        return isinstance(error, BaseJsonRpcError) and error.code in self._retry_codes
+
+    async def _publish(self, request: JsonRpcRequest, correlation_id: str):
+        message = message_class()(
+            request.json(exclude_none=True).encode(),
+            content_type="application/json",
+            correlation_id=correlation_id,
+            reply_to=self._callback,
+        )
+        if isinstance(self._exchange, PublishBuffer):
+            await self._exchange.publish(message, routing_key=self._name, droppable=self._ignore_result)
+        else:
+            await self._exchange.publish(message, routing_key=self._name)
+
+    async def _send(self, request: JsonRpcRequest, correlation_ids: list) -> asyncio.Future:
         correlation_id = str(uuid.uuid4())
         future = self._loop.create_future()
         self._futures[correlation_id] = future
+        correlation_ids.append(correlation_id)
+        await self._publish(request, correlation_id)
+        return future
+
+    async def _attempt(self, request: JsonRpcRequest) -> str:
+        started = time.monotonic()
+        correlation_ids = []
+        try:
+            done, pending = set(), {await self._send(request, correlation_ids)}
+            delay = self.hedge_delay() if self._hedge else None
+            if delay is not None and (self._timeout is None or delay < self._timeout):
+                done, pending = await asyncio.wait(pending, timeout=delay)
+                if not done:
+                    self.logger.debug(f'Hedging request to method {self._name}')
+                    pending.add(await self._send(request, correlation_ids))
+            if not done:
+                remaining = None if self._timeout is None else max(self._timeout - (time.monotonic() - started), 0)
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                self._latencies.append(self._timeout)
+                raise asyncio.TimeoutError()
+            response = done.pop().result()
+            self._latencies.append(time.monotonic() - started)
+            return response
+        finally:
+            for correlation_id in correlation_ids:
+                future = self._futures.pop(correlation_id, None)
+                if future is not None:
+                    future.cancel()
+
+    async def __call__(self, *args, **kwargs):
+        params = args if args else kwargs
         if self._ignore_result:
-            request = JsonRpcRequest(method=self._name, params=params)
-        else:
-            request = JsonRpcRequest(method=self._name, params=params, id=self._id)
-            self._id += 1
-        await self._exchange.publish(
-            Message(
-                request.json(exclude_none=True).encode(),
-                content_type="application/json",
-                correlation_id=correlation_id,
-                reply_to=self._callback,
-            ),
-            routing_key=self._name,
-        )
-        if not self._ignore_result:
-            result = json.loads(await future)
-            if 'error' in result.keys():
-                raise ErrorMap.get(result['error']['code'])()
-            if not self._ignore_result:
+            await self._publish(JsonRpcRequest(method=self._name, params=params), str(uuid.uuid4()))
+            return
+        request = JsonRpcRequest(method=self._name, params=params, id=self._id)
+        self._id += 1
+        for attempt in range(self._retries + 1):
+            try:
+                result = json.loads(await self._attempt(request))
+                if 'error' in result.keys():
+                    raise ErrorMap.get(result['error']['code'])()
                 return JsonRpcResponse(**result).result
+            except (asyncio.TimeoutError, BaseJsonRpcError) as error:
+                if attempt == self._retries or not self.is_retryable(error):
+                    raise
+                self.logger.warning(f'Retrying method {self._name} after {error!r}')
+                await asyncio.sleep(self.backoff_delay(attempt))
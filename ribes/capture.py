@@ -0,0 +1,136 @@
+#
+#    Copyright 2022 Alessio Pinna <alessio.pinna@aiselis.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import asyncio
+import gzip
+import json
+import logging
+import random
+import time
+from typing import Callable, List, Optional, Iterator, Tuple
+
+Redactor = Callable[[dict], Optional[dict]]
+
+
+def open_capture(path: str, mode: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def read_capture(path: str) -> Iterator[dict]:
+    skipped = 0
+    with open_capture(path, 'r') as file:
+        try:
+            for number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as error:
+                    skipped += 1
+                    Capture.logger.warning(f'Capture {path} skipped line {number}: {error}')
+        except EOFError:
+            Capture.logger.warning(f'Capture {path} is truncated')
+    if skipped:
+        Capture.logger.warning(f'Capture {path} skipped {skipped} malformed lines')
+
+
+class Capture:
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, path: str, sample_rate: float = 0.01, queue_size: int = 1000, batch_size: int = 100):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.redactors: List[Redactor] = []
+        self.dropped = 0
+        self._file = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._started = time.time()
+
+    def redactor(self, func: Redactor) -> Redactor:
+        self.redactors.append(func)
+        return func
+
+    def should_sample(self) -> bool:
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def record(self, request: str, duration: float):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        try:
+            self._queue.put_nowait((time.time() - self._started, request, duration))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def encode(self, entry: Tuple[float, str, float]) -> Optional[str]:
+        offset, request, duration = entry
+        try:
+            body = json.loads(request)
+            for redactor in self.redactors:
+                body = redactor(body)
+                if body is None:
+                    return None
+        except Exception as error:
+            self.logger.error(f'Capture skipped request: {error!r}')
+            return None
+        entry = {
+            'time': round(offset, 6),
+            'method': body.get('method') if isinstance(body, dict) else None,
+            'duration': round(duration, 6),
+            'request': body,
+        }
+        return json.dumps(entry, separators=(',', ':')) + '\n'
+
+    def _write(self, lines: List[str]):
+        if self._file is None:
+            self._file = open_capture(self.path, 'a')
+        self._file.writelines(lines)
+        self._file.flush()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            entries = [await self._queue.get()]
+            while len(entries) < self.batch_size and not self._queue.empty():
+                entries.append(self._queue.get_nowait())
+            if entries[-1] is None:
+                closing = True
+                entries.pop()
+            lines = [line for line in map(self.encode, entries) if line]
+            if lines:
+                try:
+                    await loop.run_in_executor(None, self._write, lines)
+                except Exception as error:
+                    self.dropped += len(lines)
+                    self.logger.error(f'Capture failed to write {len(lines)} requests: {error!r}')
+
+    async def close(self):
+        if self._task is not None:
+            if not self._task.done():
+                try:
+                    self._queue.put_nowait(None)
+                except asyncio.QueueFull:
+                    await self._queue.put(None)
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = self._queue = None
+        if self._file is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._file.close)
+            self._file = None
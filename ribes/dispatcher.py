@@ -17,19 +17,24 @@ import datetime
 import inspect
 import json
 import logging
-from typing import Optional
+import time
+from typing import Optional, Dict, List
 
-import dateutil.parser
 from pydantic import ValidationError
 from pydantic.main import BaseModel
 
 from ribes.errors import ParseError, BaseJsonRpcError, InvalidParamsError, InternalError
 from ribes.models import JsonRpcRequest, JsonRpcResponse, JsonRpcError, ErrorStatus
+from ribes.profiler import Profiler
 
 
 class Dispatcher:
     logger = logging.getLogger(__name__)
-    method_registry = {}
+
+    def __init__(self, profiler: Optional[Profiler] = None):
+        self.profiler = profiler
+        self.method_registry = {}
+        self.namespaces: Dict[str, List[str]] = {}
 
     @staticmethod
     def dict_to_parameters(signature: inspect.Signature, *args, **kwargs) -> dict:
@@ -40,6 +45,7 @@ class Dispatcher:
                 if issubclass(param_info.annotation, BaseModel):
                     result[param_name] = param_info.annotation(**value)
                 elif param_info.annotation is datetime.datetime:
+                    import dateutil.parser
                     result[param_name] = dateutil.parser.isoparser().isoparse(value)
                 elif param_info.annotation is inspect.Signature.empty:
                     result[param_name] = value
@@ -59,21 +65,39 @@ class Dispatcher:
         return JsonRpcError(error=ErrorStatus(code=code, message=message), id=id).json(exclude_none=True)
 
     def register(self, name: str, func):
+        if name not in self.method_registry:
+            self.namespaces.setdefault(name.rpartition('.')[0], []).append(name)
         self.method_registry[name] = (func, inspect.signature(func), inspect.iscoroutinefunction(func))
 
     async def dispatch(self, request: str) -> Optional[str]:
+        record = None
+        failed = False
         try:
+            started = time.perf_counter()
             jsonrpc_request = JsonRpcRequest(**json.loads(request))
             self.logger.info(f'Request to method {jsonrpc_request.method}')
+            if self.profiler and self.profiler.should_sample(jsonrpc_request.method):
+                record = self.profiler.start(jsonrpc_request.method, started, len(request))
             method, method_signature, method_coro = self.method_registry[jsonrpc_request.method]
             if isinstance(jsonrpc_request.params, list):
                 params = Dispatcher.dict_to_parameters(method_signature, *jsonrpc_request.params)
             else:
                 params = self.dict_to_parameters(method_signature, **jsonrpc_request.params)
-            response = (await method(**params)) if method_coro else method(**params)
+            if record:
+                record.mark('params')
+                response = await self.profiler.call(record, method, method_coro, params)
+                record.mark('handler')
+            else:
+                response = (await method(**params)) if method_coro else method(**params)
             if jsonrpc_request.id:
                 return JsonRpcResponse(result=response, id=jsonrpc_request.id).json(exclude_none=True)
         except ValidationError:
+            failed = True
             return self.to_jsonrpc_error(ParseError())
         except Exception as error:
+            failed = True
             return self.to_jsonrpc_error(error)
+        finally:
+            if record:
+                record.mark('error' if failed else 'serialize')
+                self.profiler.finish(record)
@@ -49,6 +49,10 @@ class InternalError(BaseJsonRpcError):
     message = 'Internal error'
 
 
+class ShutdownError(Exception):
+    """ Pending call failed by application drain """
+
+
 class ErrorMap:
     _map = dict([
         (ParseError.code, ParseError),
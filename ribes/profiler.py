@@ -0,0 +1,128 @@
+#
+#    Copyright 2022 Alessio Pinna <alessio.pinna@aiselis.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import random
+import time
+from collections import deque, Counter
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Iterable, List
+
+
+def coroutine_stack(coro) -> List[str]:
+    stack = []
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame is None:
+            break
+        stack.append(f'{frame.f_code.co_name} ({frame.f_code.co_filename}:{frame.f_lineno})')
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    return stack
+
+
+@dataclass
+class ProfileRecord:
+    method: str
+    request_size: int
+    started: float
+    phases: Dict[str, float] = field(default_factory=dict)
+    stack: Optional[str] = None
+
+    def __post_init__(self):
+        self._last = self.started
+
+    @property
+    def total(self) -> float:
+        return self._last - self.started
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+
+class Profiler:
+    logger = logging.getLogger(__name__)
+
+    def __init__(self,
+                 sample_rate: float = 0.0,
+                 methods: Iterable[str] = (),
+                 slow_threshold: float = 1.0,
+                 buffer_size: int = 100,
+                 use_cprofile: bool = False,
+                 stack_interval: float = 0.01,
+                 ):
+        self.sample_rate = sample_rate
+        self.methods = set(methods)
+        self.slow_threshold = slow_threshold
+        self.use_cprofile = use_cprofile
+        self.stack_interval = stack_interval
+        self._records = deque(maxlen=buffer_size)
+
+    def should_sample(self, method: str) -> bool:
+        return method in self.methods or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def start(self, method: str, started: float, request_size: int) -> ProfileRecord:
+        record = ProfileRecord(method=method, request_size=request_size, started=started)
+        record.mark('decode')
+        return record
+
+    async def call(self, record: ProfileRecord, method, method_coro: bool, params: dict):
+        if method_coro:
+            if not self.use_cprofile:
+                return await method(**params)
+            return await self.sample(record, method(**params))
+        if not self.use_cprofile:
+            return method(**params)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return method(**params)
+        finally:
+            profile.disable()
+            stream = io.StringIO()
+            pstats.Stats(profile, stream=stream).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(20)
+            record.stack = stream.getvalue()
+
+    async def sample(self, record: ProfileRecord, coro):
+        task = asyncio.ensure_future(coro)
+        samples = Counter()
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=self.stack_interval)
+                if done:
+                    return task.result()
+                samples[' <- '.join(reversed(coroutine_stack(task.get_coro())))] += 1
+        finally:
+            task.cancel()
+            if samples:
+                lines = [f'{sum(samples.values())} stack samples every {self.stack_interval}s']
+                lines += [f'{count:6d}  {stack}' for stack, count in samples.most_common(20)]
+                record.stack = '\n'.join(lines)
+
+    def finish(self, record: ProfileRecord):
+        if record.total >= self.slow_threshold:
+            self.logger.warning(f'Slow request to method {record.method} took {record.total:.3f}s')
+            self._records.append(record)
+
+    def records(self) -> List[ProfileRecord]:
+        return list(self._records)
+
+    def clear(self):
+        self._records.clear()
@@ -0,0 +1,148 @@
+#
+#    Copyright 2022 Alessio Pinna <alessio.pinna@aiselis.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from aio_pika import Message
+    from aio_pika.abc import AbstractExchange
+
+
+class PublishBufferFull(Exception):
+    """ Publish buffer memory budget exceeded """
+
+
+@dataclass
+class PublishMetrics:
+    published: int = 0
+    failed: int = 0
+    dropped: int = 0
+    blocked: int = 0
+    batches: int = 0
+    pending: int = 0
+    pending_bytes: int = 0
+
+
+class PublishBuffer:
+    logger = logging.getLogger(__name__)
+
+    overflow_policies = ('block', 'drop', 'error')
+
+    def __init__(self,
+                 exchange: 'AbstractExchange',
+                 batch_size: int = 100,
+                 flush_interval: float = 0.005,
+                 max_bytes: int = 8 * 1024 * 1024,
+                 overflow: str = 'block',
+                 ):
+        if overflow not in self.overflow_policies:
+            raise ValueError(f'Unknown overflow policy {overflow!r}')
+        self._exchange = exchange
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.overflow = overflow
+        self.metrics = PublishMetrics()
+        self._pending: Deque[Tuple['Message', str, asyncio.Future]] = deque()
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._task: asyncio.Task = None
+        self._closing = False
+
+    async def publish(self, message: 'Message', routing_key: str, droppable: bool = False):
+        loop = asyncio.get_running_loop()
+        size = len(message.body)
+        blocked = False
+        while self.metrics.pending_bytes and self.metrics.pending_bytes + size > self.max_bytes:
+            if self.overflow == 'error':
+                raise PublishBufferFull()
+            if self.overflow == 'drop' and droppable:
+                self.metrics.dropped += 1
+                return
+            if not blocked:
+                blocked = True
+                self.metrics.blocked += 1
+            self._space.clear()
+            await self._space.wait()
+        published = loop.create_future()
+        entry = (message, routing_key, published)
+        self._pending.append(entry)
+        self.metrics.pending += 1
+        self.metrics.pending_bytes += size
+        if self._task is None:
+            self._task = loop.create_task(self._run())
+        self._wakeup.set()
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+        try:
+            await published
+        except asyncio.CancelledError:
+            if entry in self._pending:
+                self._pending.remove(entry)
+                self.metrics.pending -= 1
+                self.metrics.pending_bytes -= size
+                self._space.set()
+            raise
+
+    async def flush(self):
+        while self._pending:
+            batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            self._full.clear()
+            results = await asyncio.gather(
+                *(self._exchange.publish(message, routing_key=routing_key) for message, routing_key, _ in batch),
+                return_exceptions=True,
+            )
+            for (message, _, published), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    self.metrics.failed += 1
+                    if not published.done():
+                        published.set_exception(result)
+                else:
+                    self.metrics.published += 1
+                    if not published.done():
+                        published.set_result(result)
+                self.metrics.pending -= 1
+                self.metrics.pending_bytes -= len(message.body)
+            self.metrics.batches += 1
+            self._space.set()
+
+    async def _run(self):
+        while self._pending or not self._closing:
+            self._wakeup.clear()
+            if not self._pending:
+                await self._wakeup.wait()
+                continue
+            if not self._closing:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self.flush()
+
+    async def close(self):
+        self._closing = True
+        self._wakeup.set()
+        self._full.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+        self._closing = False
@@ -0,0 +1,110 @@
+#
+#    Copyright 2022 Alessio Pinna <alessio.pinna@aiselis.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import statistics
+import sys
+import time
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+
+from ribes.capture import read_capture
+from ribes.dispatcher import Dispatcher
+
+
+@dataclass
+class ReplayReport:
+    latencies: List[float]
+    errors: int
+    elapsed: float
+
+    @property
+    def throughput(self) -> float:
+        return len(self.latencies) / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, value: float) -> float:
+        if not self.latencies:
+            return 0.0
+        latencies = sorted(self.latencies)
+        return latencies[int(value / 100 * (len(latencies) - 1))]
+
+    def __str__(self) -> str:
+        lines = [
+            f'requests   {len(self.latencies)}',
+            f'errors     {self.errors}',
+            f'elapsed    {self.elapsed:.3f} s',
+            f'throughput {self.throughput:.1f} req/s',
+        ]
+        if self.latencies:
+            lines.append(f'mean       {statistics.mean(self.latencies) * 1000:.3f} ms')
+            for value in (50, 90, 99):
+                lines.append(f'p{value:<9} {self.percentile(value) * 1000:.3f} ms')
+            lines.append(f'max        {max(self.latencies) * 1000:.3f} ms')
+        return '\n'.join(lines)
+
+
+async def replay(dispatcher: Dispatcher, requests: Iterable[str], rate: Optional[float] = None) -> ReplayReport:
+    latencies = []
+    errors = 0
+
+    async def send(request: str):
+        nonlocal errors
+        started = time.perf_counter()
+        response = await dispatcher.dispatch(request)
+        latencies.append(time.perf_counter() - started)
+        if response and 'error' in json.loads(response):
+            errors += 1
+
+    started = time.perf_counter()
+    if rate:
+        tasks = []
+        for index, request in enumerate(requests):
+            delay = started + index / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(request)))
+        await asyncio.gather(*tasks)
+    else:
+        for request in requests:
+            await send(request)
+    return ReplayReport(latencies, errors, time.perf_counter() - started)
+
+
+def load_app(path: str):
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    module_name, _, attribute = path.partition(':')
+    return getattr(importlib.import_module(module_name), attribute or 'app')
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog='ribes')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('replay', help='replay captured requests through the dispatcher')
+    command.add_argument('app', help='application to load, as module:attribute')
+    command.add_argument('capture', help='capture file written by Ribes')
+    command.add_argument('--rate', type=float, default=None, help='requests per second, as fast as possible if unset')
+    command.add_argument('--method', action='append', help='replay only the given methods')
+    args = parser.parse_args(argv)
+    app = load_app(args.app)
+    requests = [
+        json.dumps(entry['request']) for entry in read_capture(args.capture)
+        if not args.method or entry['method'] in args.method
+    ]
+    print(asyncio.run(replay(app.dispatcher, requests, args.rate)))
@@ -13,10 +13,31 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+from functools import lru_cache
+
 from pydantic import BaseSettings
 
 
 class RibesSettings(BaseSettings):
     broker_url: str = None
     routes: dict = {'*': 'rpc'}
+    queue_groups: dict = {}
     exchange: str = 'rpc'
+    profile_sample_rate: float = 0.0
+    profile_methods: set = set()
+    profile_slow_threshold: float = 1.0
+    profile_buffer_size: int = 100
+    profile_cprofile: bool = False
+    profile_stack_interval: float = 0.01
+    capture_path: str = None
+    capture_sample_rate: float = 0.01
+    publish_buffer: bool = False
+    publish_batch_size: int = 100
+    publish_flush_interval: float = 0.005
+    publish_max_bytes: int = 8 * 1024 * 1024
+    publish_overflow: str = 'block'
+
+
+@lru_cache()
+def get_settings() -> RibesSettings:
+    return RibesSettings()
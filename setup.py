@@ -67,5 +67,8 @@ setup(
         'pydantic',
     ],
     include_package_data=True,
+    entry_points={
+        'console_scripts': ['ribes=ribes.replay:main'],
+    },
 
 )
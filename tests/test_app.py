@@ -14,6 +14,9 @@
 #    limitations under the License.
 
 import asyncio
+import json
+import subprocess
+import sys
 from unittest.mock import patch, AsyncMock
 
 import pytest
@@ -21,6 +24,209 @@ from aio_pika.abc import AbstractIncomingMessage
 
 import ribes.app
 from ribes.dispatcher import Dispatcher
+from ribes.errors import ShutdownError
+from ribes.publisher import PublishBuffer
+from ribes.settings import get_settings
+from tests.utils import does_not_raise
+
+
+def test_lazy_import():
+    output = subprocess.check_output([
+        sys.executable, '-c', "import sys, ribes.app; print('aio_pika' in sys.modules, 'dateutil' in sys.modules)"
+    ])
+    assert output.split() == [b'False', b'False']
+
+
+def test_settings_cached():
+    first, second = ribes.app.Ribes("first"), ribes.app.Ribes("second")
+    assert (first.settings.exchange, second.settings.exchange) == ("first", "second")
+    assert get_settings().exchange == 'rpc'
+    assert get_settings() is get_settings()
+
+
+@pytest.mark.parametrize(
+    "methods,queue_groups,expected",
+    [
+        ([], {}, {'*': 'rpc'}),
+        (['ping', 'math.add', 'math.sub', 'report.build'], {},
+         {'*': 'rpc', 'math.*': 'test.math', 'report.*': 'test.report'}),
+        (['math.add', 'math.linear.solve', 'report.build'], {'math': 'light', 'math.linear': 'heavy'},
+         {'*': 'rpc', 'math.*': 'light', 'math.linear.*': 'heavy', 'report.*': 'test.report'}),
+    ]
+)
+def test_routes(methods, queue_groups, expected):
+    app = ribes.app.Ribes("test")
+    app.settings.queue_groups = queue_groups
+    for method in methods:
+        app.register(method)(lambda: None)
+    assert app.routes() == expected
+
+
+@pytest.mark.parametrize(
+    "pattern,routing_key,expected",
+    [
+        ('*', 'ping', True),
+        ('*', 'math.add', False),
+        ('#', 'math.add', True),
+        ('math.#', 'math', True),
+        ('math.*', 'math.linear.solve', False),
+        ('*.linear.#', 'math.linear.solve', True),
+    ]
+)
+def test_topic_matches(pattern, routing_key, expected):
+    assert ribes.app.topic_matches(pattern, routing_key) == expected
+
+
+def test_routes_overlap():
+    app = ribes.app.Ribes("test")
+    app.settings.routes = {'#': 'rpc'}
+    app.register('math.add')(lambda: None)
+    with pytest.raises(ValueError):
+        app.routes()
+
+
+@patch.object(ribes.app, 'connect')
+@pytest.mark.asyncio
+async def test_start_listener(mock_connect):
+    app = ribes.app.Ribes("test")
+    app.settings.queue_groups = {'math': 'rpc'}
+    for method in ['math.add', 'report.build']:
+        app.register(method)(lambda: None)
+    await app.start_listener()
+    channel = mock_connect.return_value.channel.return_value
+    declared = [call.args[0] for call in channel.declare_queue.call_args_list]
+    assert declared == ['rpc', 'test.report']
+    assert channel.declare_queue.return_value.consume.await_count == 2
+
+
+@patch.object(ribes.app, 'connect')
+@pytest.mark.asyncio
+async def test_drain(mock_connect):
+    app = ribes.app.Ribes("test")
+    started = asyncio.Event()
+
+    @app.register('slow')
+    async def slow():
+        started.set()
+        await asyncio.sleep(0.05)
+        return 1
+
+    await app.start_listener()
+    await app.start_caller()
+    channel = mock_connect.return_value.channel.return_value
+    exchange = channel.declare_exchange.return_value
+    pending = app._futures['12345'] = asyncio.get_running_loop().create_future()
+    message = AsyncMock(spec=AbstractIncomingMessage)
+    message.correlation_id = '12345'
+    message.reply_to = 'reply'
+    message.body = json.dumps({'jsonrpc': '2.0', 'method': 'slow', 'id': 1}).encode()
+    handler = asyncio.create_task(app.on_request_message(message))
+    await started.wait()
+    await app.drain(timeout=1)
+    assert handler.done()
+    exchange.publish.assert_awaited()
+    channel.declare_queue.return_value.cancel.assert_awaited()
+    mock_connect.return_value.close.assert_awaited()
+    with pytest.raises(ShutdownError):
+        await pending
+    await app.wait_drained()
+
+
+@patch.object(ribes.app, 'connect')
+@pytest.mark.asyncio
+async def test_drain_timeout(mock_connect):
+    app = ribes.app.Ribes("test")
+    started = asyncio.Event()
+
+    @app.register('stuck')
+    async def stuck():
+        started.set()
+        await asyncio.sleep(60)
+
+    await app.start_listener()
+    exchange = mock_connect.return_value.channel.return_value.declare_exchange.return_value
+    message = AsyncMock(spec=AbstractIncomingMessage)
+    message.correlation_id = '12345'
+    message.reply_to = 'reply'
+    message.body = json.dumps({'jsonrpc': '2.0', 'method': 'stuck', 'id': 1}).encode()
+    handler = asyncio.create_task(app.on_request_message(message))
+    await started.wait()
+    await app.drain(timeout=0.01)
+    assert handler.cancelled()
+    message.reject.assert_awaited_with(requeue=True)
+    exchange.publish.assert_not_awaited()
+    mock_connect.return_value.close.assert_awaited()
+
+
+@patch.object(ribes.app, 'connect')
+@pytest.mark.asyncio
+async def test_drain_teardown_error(mock_connect):
+    app = ribes.app.Ribes("test")
+    await app.start_listener()
+    mock_connect.return_value.close.side_effect = ConnectionError()
+    await app.drain()
+    assert not app._draining
+    await asyncio.wait_for(app.wait_drained(), 1)
+    await asyncio.wait_for(app.drain(), 1)
+
+
+@patch.object(ribes.app, 'connect')
+@pytest.mark.asyncio
+async def test_drain_requeue(mock_connect):
+    app = ribes.app.Ribes("test")
+    app._draining = True
+    message = AsyncMock(spec=AbstractIncomingMessage)
+    await app.on_request_message(message)
+    message.reject.assert_awaited_with(requeue=True)
+    message.process.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "error,expected",
+    [
+        (None, does_not_raise()),
+        (ConnectionError(), pytest.raises(ConnectionError)),
+    ]
+)
+@patch.object(ribes.app, 'connect')
+@pytest.mark.asyncio
+async def test_publish_buffer(mock_connect, error, expected):
+    app = ribes.app.Ribes("test")
+    app.settings.publish_buffer = True
+    app.register('ping')(lambda: 'pong')
+    await app.start_listener()
+    assert isinstance(app.publisher, PublishBuffer)
+    exchange = mock_connect.return_value.channel.return_value.declare_exchange.return_value
+    exchange.publish.side_effect = error
+    message = AsyncMock(spec=AbstractIncomingMessage)
+    message.correlation_id = '12345'
+    message.reply_to = 'reply'
+    message.body = json.dumps({'jsonrpc': '2.0', 'method': 'ping', 'id': 1}).encode()
+    with expected:
+        await app.on_request_message(message)
+    exchange.publish.assert_awaited_once()
+    await app.drain()
+
+
+@patch.object(ribes.app, 'connect')
+@pytest.mark.asyncio
+async def test_publish_buffer_drain_timeout(mock_connect):
+    app = ribes.app.Ribes("test")
+    app.settings.publish_buffer = True
+    app.settings.publish_flush_interval = 10
+    app.register('ping')(lambda: 'pong')
+    await app.start_listener()
+    exchange = mock_connect.return_value.channel.return_value.declare_exchange.return_value
+    message = AsyncMock(spec=AbstractIncomingMessage)
+    message.correlation_id = '12345'
+    message.reply_to = 'reply'
+    message.body = json.dumps({'jsonrpc': '2.0', 'method': 'ping', 'id': 1}).encode()
+    handler = asyncio.create_task(app.on_request_message(message))
+    await asyncio.sleep(0.01)
+    await app.drain(timeout=0.01)
+    assert handler.cancelled()
+    message.reject.assert_awaited_with(requeue=True)
+    exchange.publish.assert_not_awaited()
 
 
 @patch.object(ribes.app, 'Dispatcher', spec=Dispatcher)
@@ -54,3 +260,9 @@ class TestRibes:
         getattr(self.app, '_futures')['12345'] = asyncio.Future()
         await self.app.on_response_message(mock_message)
 
+    @pytest.mark.asyncio
+    async def test_on_response_message_late(self, mock_connect, mock_dispatcher):
+        mock_message = AsyncMock(spec=AbstractIncomingMessage)
+        mock_message.correlation_id = 'unknown'
+        mock_message.body = b'body'
+        await self.app.on_response_message(mock_message)
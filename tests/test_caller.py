@@ -13,6 +13,7 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+import asyncio
 from asyncio import Future, AbstractEventLoop
 from typing import MutableMapping
 from unittest.mock import AsyncMock, Mock
@@ -21,8 +22,9 @@ import pytest
 from aio_pika.abc import AbstractExchange
 
 from ribes.caller import RemoteCaller
-from ribes.errors import InvalidRequestError, BaseJsonRpcError
+from ribes.errors import InvalidRequestError, BaseJsonRpcError, InternalError
 from ribes.models import JsonRpcResponse, JsonRpcError, ErrorStatus
+from ribes.publisher import PublishBuffer
 from tests.utils import does_not_raise
 
 
@@ -53,3 +55,83 @@ async def test_call(ignore_result, expected_result, expected):
         caller = RemoteCaller("method", ignore_result, loop, futures, exchange, "callback")
         result = await caller(0, 1)
         assert expected_result == result
+
+
+def reply_with(futures, replies):
+    replies = iter(replies)
+
+    async def _publish(message, routing_key):
+        reply = next(replies)
+        if reply is not None:
+            asyncio.get_running_loop().call_soon(futures.pop(message.correlation_id).set_result, reply)
+
+    return _publish
+
+
+@pytest.mark.parametrize(
+    "replies,retries,expected",
+    [
+        ([None, JsonRpcResponse(id=1, result=3).json()], 1, does_not_raise()),
+        ([None, None], 1, pytest.raises(asyncio.TimeoutError)),
+        ([JsonRpcError(id=1, error=ErrorStatus(code=InternalError.code, message='')).json(),
+          JsonRpcResponse(id=1, result=3).json()], 1, does_not_raise()),
+        ([JsonRpcError(id=1, error=ErrorStatus(code=InvalidRequestError.code, message='')).json()], 1,
+         pytest.raises(InvalidRequestError)),
+    ]
+)
+@pytest.mark.asyncio
+async def test_call_retry(replies, retries, expected):
+    futures: MutableMapping[str, Future] = {}
+    exchange = AsyncMock(spec=AbstractExchange)
+    exchange.publish.side_effect = reply_with(futures, replies)
+    caller = RemoteCaller("method", False, asyncio.get_running_loop(), futures, exchange, "callback",
+                          timeout=0.05, retries=retries, backoff=0.01)
+    with expected:
+        assert await caller(0, 1) == 3
+    assert not futures
+
+
+@pytest.mark.parametrize(
+    "replies,published",
+    [
+        ([JsonRpcResponse(id=1, result=3).json()], 1),
+        ([None, JsonRpcResponse(id=1, result=3).json()], 2),
+    ]
+)
+@pytest.mark.asyncio
+async def test_call_hedge(replies, published):
+    futures: MutableMapping[str, Future] = {}
+    exchange = AsyncMock(spec=AbstractExchange)
+    exchange.publish.side_effect = reply_with(futures, replies)
+    caller = RemoteCaller("method", False, asyncio.get_running_loop(), futures, exchange, "callback",
+                          timeout=1, hedge=True, hedge_delay=0.05)
+    assert await caller(0, 1) == 3
+    assert exchange.publish.await_count == published
+    assert not futures
+
+
+@pytest.mark.parametrize("ignore_result", [True, False])
+@pytest.mark.asyncio
+async def test_call_buffered_publish_failed(ignore_result):
+    futures: MutableMapping[str, Future] = {}
+    exchange = AsyncMock(spec=AbstractExchange)
+    exchange.publish.side_effect = ConnectionError()
+    buffer = PublishBuffer(exchange)
+    caller = RemoteCaller("method", ignore_result, asyncio.get_running_loop(), futures, buffer, "callback")
+    with pytest.raises(ConnectionError):
+        await caller(0, 1)
+    assert not futures
+    await buffer.close()
+
+
+@pytest.mark.asyncio
+async def test_call_hedge_after_timeout():
+    futures: MutableMapping[str, Future] = {}
+    exchange = AsyncMock(spec=AbstractExchange)
+    exchange.publish.side_effect = reply_with(futures, [None])
+    caller = RemoteCaller("method", False, asyncio.get_running_loop(), futures, exchange, "callback",
+                          timeout=0.02, hedge=True, hedge_delay=0.05)
+    with pytest.raises(asyncio.TimeoutError):
+        await caller(0, 1)
+    assert exchange.publish.await_count == 1
+    assert list(caller._latencies) == [0.02]
@@ -0,0 +1,91 @@
+#
+#    Copyright 2022 Alessio Pinna <alessio.pinna@aiselis.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import asyncio
+import json
+
+import pytest
+
+from ribes.capture import Capture, read_capture
+
+
+@pytest.mark.parametrize("filename", ["capture.jsonl", "capture.jsonl.gz"])
+@pytest.mark.asyncio
+async def test_capture(tmp_path, filename):
+    path = str(tmp_path / filename)
+    capture = Capture(path)
+
+    @capture.redactor
+    def redact_password(request):
+        if request['method'] == 'login':
+            request['params']['password'] = '***'
+        return request
+
+    capture.redactor(lambda request: None if request['method'] == 'secret' else request)
+    capture.record(json.dumps({'jsonrpc': '2.0', 'method': 'login', 'params': {'password': 'x'}, 'id': 1}), 0.5)
+    capture.record(json.dumps({'jsonrpc': '2.0', 'method': 'secret', 'params': [], 'id': 2}), 0.1)
+    capture.record('invalid', 0.1)
+    await capture.close()
+    entries = list(read_capture(path))
+    assert len(entries) == 1
+    assert entries[0]['method'] == 'login'
+    assert entries[0]['duration'] == 0.5
+    assert entries[0]['request']['params'] == {'password': '***'}
+
+
+@pytest.mark.parametrize("sample_rate,expected", [(0.0, False), (1.0, True)])
+def test_should_sample(tmp_path, sample_rate, expected):
+    assert Capture(str(tmp_path / 'capture.jsonl'), sample_rate).should_sample() == expected
+
+
+@pytest.mark.asyncio
+async def test_capture_bounded(tmp_path):
+    path = str(tmp_path / 'capture.jsonl')
+    capture = Capture(path, queue_size=2)
+    for id in range(5):
+        capture.record(json.dumps({'jsonrpc': '2.0', 'method': 'ping', 'id': id}), 0.1)
+    assert capture.dropped == 3
+    await capture.close()
+    assert [entry['request']['id'] for entry in read_capture(path)] == [0, 1]
+
+
+@pytest.mark.asyncio
+async def test_capture_flushed(tmp_path):
+    path = str(tmp_path / 'capture.jsonl.gz')
+    capture = Capture(path)
+    capture.record(json.dumps({'jsonrpc': '2.0', 'method': 'ping', 'id': 1}), 0.1)
+    for _ in range(10):
+        await asyncio.sleep(0.01)
+    assert len(list(read_capture(path))) == 1
+    await capture.close()
+
+
+@pytest.mark.asyncio
+async def test_capture_write_error(tmp_path):
+    capture = Capture(str(tmp_path / 'missing' / 'capture.jsonl'), queue_size=2)
+    for id in range(2):
+        capture.record(json.dumps({'jsonrpc': '2.0', 'method': 'ping', 'id': id}), 0.1)
+    await asyncio.sleep(0.05)
+    for id in range(2):
+        capture.record(json.dumps({'jsonrpc': '2.0', 'method': 'ping', 'id': id}), 0.1)
+    await asyncio.wait_for(capture.close(), 1)
+    assert capture.dropped == 4
+
+
+def test_read_capture_malformed(tmp_path, caplog):
+    path = tmp_path / 'capture.jsonl'
+    path.write_text('{"method": "a"}\n{"method": \n{"method": "b"}\n{"meth')
+    assert [entry['method'] for entry in read_capture(str(path))] == ['a', 'b']
+    assert 'skipped 2 malformed lines' in caplog.text
@@ -110,6 +110,15 @@ def test_register(function_factory, func):
     assert func in dispatcher.method_registry.keys()
 
 
+def test_register_namespaces(function_factory):
+    dispatcher, other = Dispatcher(), Dispatcher()
+    for name in ['date', 'math.date', 'math.generic', 'math.linear.date']:
+        dispatcher.register(name, function_factory('date'))
+    assert dispatcher.namespaces == {'': ['date'], 'math': ['math.date', 'math.generic'],
+                                     'math.linear': ['math.linear.date']}
+    assert not other.method_registry
+
+
 @pytest.mark.parametrize(
     "func,id,args,expected",
     [
@@ -0,0 +1,89 @@
+#
+#    Copyright 2022 Alessio Pinna <alessio.pinna@aiselis.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import asyncio
+import json
+import time
+
+import pytest
+
+from ribes.dispatcher import Dispatcher
+from ribes.profiler import Profiler
+
+
+def slow(a: int):
+    time.sleep(0.01)
+    return a
+
+
+async def slow_async(a: int):
+    await asyncio.sleep(0.01)
+    return a
+
+
+@pytest.mark.parametrize(
+    "sample_rate,methods,slow_threshold,use_cprofile,expected",
+    [
+        (0.0, [], 0.0, False, 0),
+        (1.0, [], 0.0, False, 1),
+        (0.0, ['slow'], 0.0, True, 1),
+        (1.0, [], 60.0, False, 0),
+    ]
+)
+@pytest.mark.asyncio
+async def test_dispatch_profiled(sample_rate, methods, slow_threshold, use_cprofile, expected):
+    profiler = Profiler(sample_rate=sample_rate, methods=methods, slow_threshold=slow_threshold,
+                        use_cprofile=use_cprofile)
+    dispatcher = Dispatcher(profiler)
+    dispatcher.register('slow', slow)
+    request = json.dumps({'jsonrpc': '2.0', 'method': 'slow', 'params': [1], 'id': 1})
+    assert await dispatcher.dispatch(request)
+    records = profiler.records()
+    assert len(records) == expected
+    for record in records:
+        assert record.method == 'slow'
+        assert record.request_size == len(request)
+        assert set(record.phases) == {'decode', 'params', 'handler', 'serialize'}
+        assert record.phases['handler'] >= 0.01
+        assert (record.stack is not None) == use_cprofile
+
+
+def test_records_bounded():
+    profiler = Profiler(slow_threshold=0.0, buffer_size=2)
+    for method in ['a', 'b', 'c']:
+        profiler.finish(profiler.start(method, time.perf_counter(), 0))
+    assert [record.method for record in profiler.records()] == ['b', 'c']
+    profiler.clear()
+    assert not profiler.records()
+
+
+@pytest.mark.asyncio
+async def test_dispatch_profiled_async():
+    profiler = Profiler(sample_rate=1.0, slow_threshold=0.0, use_cprofile=True, stack_interval=0.001)
+    dispatcher = Dispatcher(profiler)
+    dispatcher.register('slow', slow_async)
+    await dispatcher.dispatch(json.dumps({'jsonrpc': '2.0', 'method': 'slow', 'params': [1], 'id': 1}))
+    record, = profiler.records()
+    assert record.phases['handler'] >= 0.01
+    assert 'slow_async' in record.stack
+
+
+@pytest.mark.asyncio
+async def test_dispatch_profiled_error():
+    profiler = Profiler(sample_rate=1.0, slow_threshold=0.0)
+    dispatcher = Dispatcher(profiler)
+    await dispatcher.dispatch(json.dumps({'jsonrpc': '2.0', 'method': 'missing', 'params': [1], 'id': 1}))
+    record, = profiler.records()
+    assert set(record.phases) == {'decode', 'error'}
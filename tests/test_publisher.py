@@ -0,0 +1,136 @@
+#
+#    Copyright 2022 Alessio Pinna <alessio.pinna@aiselis.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+from aio_pika import Message
+from aio_pika.abc import AbstractExchange
+
+from ribes.caller import RemoteCaller
+from ribes.publisher import PublishBuffer, PublishBufferFull
+from tests.utils import does_not_raise
+
+
+@pytest.mark.parametrize(
+    "count,batch_size,batches",
+    [
+        (10, 5, 2),
+        (3, 100, 1),
+    ]
+)
+@pytest.mark.asyncio
+async def test_coalesce(count, batch_size, batches):
+    exchange = AsyncMock(spec=AbstractExchange)
+    buffer = PublishBuffer(exchange, batch_size=batch_size, flush_interval=0.01)
+    await asyncio.gather(*(buffer.publish(Message(b'body'), routing_key=str(index)) for index in range(count)))
+    assert exchange.publish.await_count == count
+    assert buffer.metrics.published == count
+    assert buffer.metrics.batches == batches
+    assert buffer.metrics.pending == buffer.metrics.pending_bytes == 0
+    await buffer.close()
+
+
+@pytest.mark.parametrize(
+    "overflow,droppable,expected,dropped",
+    [
+        ('error', False, pytest.raises(PublishBufferFull), 0),
+        ('drop', True, does_not_raise(), 1),
+    ]
+)
+@pytest.mark.asyncio
+async def test_overflow(overflow, droppable, expected, dropped):
+    exchange = AsyncMock(spec=AbstractExchange)
+    buffer = PublishBuffer(exchange, flush_interval=1, max_bytes=4, overflow=overflow)
+    first = asyncio.create_task(buffer.publish(Message(b'body'), routing_key='key'))
+    await asyncio.sleep(0)
+    with expected:
+        await buffer.publish(Message(b'body'), routing_key='key', droppable=droppable)
+    assert buffer.metrics.dropped == dropped
+    await buffer.close()
+    await first
+    assert exchange.publish.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_overflow_block():
+    exchange = AsyncMock(spec=AbstractExchange)
+    buffer = PublishBuffer(exchange, flush_interval=0.01, max_bytes=4)
+    await asyncio.wait_for(asyncio.gather(
+        buffer.publish(Message(b'body'), routing_key='key'),
+        buffer.publish(Message(b'body'), routing_key='key'),
+    ), 1)
+    assert buffer.metrics.blocked == 1
+    await buffer.close()
+    assert exchange.publish.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_publish_failed():
+    exchange = AsyncMock(spec=AbstractExchange)
+    exchange.publish.side_effect = ConnectionError()
+    buffer = PublishBuffer(exchange)
+    with pytest.raises(ConnectionError):
+        await buffer.publish(Message(b'body'), routing_key='key')
+    await buffer.close()
+    assert buffer.metrics.failed == 1
+    assert buffer.metrics.pending == 0
+
+
+def test_unknown_overflow():
+    with pytest.raises(ValueError):
+        PublishBuffer(AsyncMock(spec=AbstractExchange), overflow='unknown')
+
+
+@pytest.mark.parametrize("ignore_result,dropped", [(True, 1), (False, 0)])
+@pytest.mark.asyncio
+async def test_drop_notifications(ignore_result, dropped):
+    exchange = AsyncMock(spec=AbstractExchange)
+    buffer = PublishBuffer(exchange, flush_interval=0.01, max_bytes=1, overflow='drop')
+    first = asyncio.create_task(buffer.publish(Message(b'body'), routing_key='key'))
+    await asyncio.sleep(0)
+    caller = RemoteCaller("method", ignore_result, asyncio.get_running_loop(), {}, buffer, "callback", timeout=0.05)
+    with does_not_raise() if ignore_result else pytest.raises(asyncio.TimeoutError):
+        await caller(0, 1)
+    await first
+    assert buffer.metrics.dropped == dropped
+    assert all(call.args[0].type is None for call in exchange.publish.call_args_list)
+    await buffer.close()
+
+
+@pytest.mark.asyncio
+async def test_publish_cancelled():
+    exchange = AsyncMock(spec=AbstractExchange)
+    buffer = PublishBuffer(exchange, flush_interval=1)
+    publish = asyncio.create_task(buffer.publish(Message(b'body'), routing_key='key'))
+    await asyncio.sleep(0)
+    publish.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await publish
+    assert buffer.metrics.pending == buffer.metrics.pending_bytes == 0
+    await buffer.close()
+    exchange.publish.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_blocked_counted_once():
+    exchange = AsyncMock(spec=AbstractExchange)
+    buffer = PublishBuffer(exchange, batch_size=1, flush_interval=0.01, max_bytes=4)
+    await asyncio.wait_for(asyncio.gather(
+        *(buffer.publish(Message(b'body'), routing_key='key') for _ in range(3))
+    ), 1)
+    assert buffer.metrics.blocked == 2
+    await buffer.close()
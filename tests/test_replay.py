@@ -0,0 +1,80 @@
+#
+#    Copyright 2022 Alessio Pinna <alessio.pinna@aiselis.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import asyncio
+import json
+import sys
+
+import pytest
+
+import ribes.app
+from ribes.capture import Capture
+from ribes.dispatcher import Dispatcher
+from ribes.replay import replay, main, load_app, ReplayReport
+
+
+def add(a: int, b: int):
+    return a + b
+
+
+app = ribes.app.Ribes("replay")
+app.register("add")(add)
+
+
+def request(method, *params):
+    return json.dumps({'jsonrpc': '2.0', 'method': method, 'params': params, 'id': 1})
+
+
+@pytest.mark.parametrize("rate", [None, 1000])
+@pytest.mark.asyncio
+async def test_replay(rate):
+    dispatcher = Dispatcher()
+    dispatcher.register('add', add)
+    report = await replay(dispatcher, [request('add', 1, 2), request('add', 3, 4), request('missing')], rate)
+    assert len(report.latencies) == 3
+    assert report.errors == 1
+    assert report.throughput > 0
+    assert report.percentile(50) <= report.percentile(99)
+    assert 'throughput' in str(report)
+
+
+def test_report_empty():
+    report = ReplayReport([], 0, 0)
+    assert report.throughput == 0
+    assert report.percentile(99) == 0
+    assert str(report)
+
+
+def test_main(tmp_path, capsys):
+    path = str(tmp_path / 'capture.jsonl')
+
+    async def write_capture():
+        capture = Capture(path)
+        capture.record(request('add', 1, 2), 0.1)
+        capture.record(request('other'), 0.1)
+        await capture.close()
+
+    asyncio.run(write_capture())
+    main(['replay', f'{__name__}:app', path, '--method', 'add'])
+    output = capsys.readouterr().out
+    assert 'requests   1' in output
+    assert 'errors     0' in output
+
+
+def test_load_app_cwd(tmp_path, monkeypatch):
+    (tmp_path / 'replay_local_service.py').write_text('app = "local"\n')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, 'path', [path for path in sys.path if path not in ('', str(tmp_path))])
+    assert load_app('replay_local_service:app') == 'local'